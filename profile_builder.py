@@ -7,6 +7,9 @@ Simple, clean Python code to:
 2. Calculate statistics (mean and std dev)
 3. Create and store user profile in database
 
+Single-user builds run all three steps server-side through the
+rebuild_profile RPC (see supabase/migrations/).
+
 Usage:
     python build_profile.py
 
@@ -15,19 +18,35 @@ Environment Variables Required:
     SUPABASE_SERVICE_KEY - Your Supabase service role key
 """
 
+import functools
+import itertools
+import logging
+import math
+import operator
 import os
-import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from typing import Optional, Dict, List, Tuple
-import numpy as np
 from supabase import create_client, Client
 from dotenv import load_dotenv
 load_dotenv()
 
+# Status messages and the summary are printed; per-feature detail from the
+# statistics steps is only emitted as DEBUG logging
+log = logging.getLogger(__name__)
+
 
 # ============================================
 # CONSTANTS
 # ============================================
 
+# Read once at import (after load_dotenv); validated when the client is created
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
+
 FEATURE_NAMES = [
     'typing_speed',
     'backspace_ratio',
@@ -39,29 +58,54 @@ FEATURE_NAMES = [
     'idle_ratio'
 ]
 
+# Profile column names for each feature's statistics, in FEATURE_NAMES order
+MEAN_COLUMNS = [f"{name}_mean" for name in FEATURE_NAMES]
+STD_COLUMNS = [f"{name}_std" for name in FEATURE_NAMES]
+
+# Returns a session's feature values as a tuple, in FEATURE_NAMES order
+_FEATURE_GETTER = operator.itemgetter(*FEATURE_NAMES)
+
 MIN_SESSIONS_REQUIRED = 8
+# Fewest sessions a profile can be built from (std dev needs at least two)
+MIN_SESSIONS_FOR_PROFILE = 2
 DATA_QUALITY_THRESHOLD = 0.85
 
+# Concurrent fetches in build_many, kept well below Supabase's connection limit
+MAX_CONCURRENT_FETCHES = 20
+
+# Rows per insert request when saving profiles in bulk
+SAVE_BATCH_SIZE = 500
+
+# Built profiles are reused for this many seconds before being rebuilt
+PROFILE_CACHE_TTL = 30
+PROFILE_CACHE_MAXSIZE = 10_000
+
 
 # ============================================
 # SUPABASE CONNECTION
 # ============================================
 
+@functools.lru_cache(maxsize=1)
+def _get_client() -> Client:
+    """Create the Supabase client once and reuse its connection pool"""
+    if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
+        raise RuntimeError(
+            "Missing environment variables! Set SUPABASE_URL and SUPABASE_SERVICE_KEY"
+        )
+    return create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+
+
+def _parse_timestamp(value: str) -> datetime:
+    """Parse an ISO 8601 timestamp returned by PostgREST"""
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
 class SupabaseConnection:
     """Handle all Supabase operations"""
     
     def __init__(self):
         """Initialize Supabase client"""
-        self.url = os.getenv("SUPABASE_URL")
-        self.key = os.getenv("SUPABASE_SERVICE_KEY")
-
-        
-        if not self.url or not self.key:
-            self._print_error("Missing environment variables!")
-            self._print_error("Set SUPABASE_URL and SUPABASE_SERVICE_KEY")
-            sys.exit(1)
-        
-        self.client: Client = create_client(self.url, self.key)
+        self.client: Client = _get_client()
         self._print_success("Connected to Supabase")
     
     def fetch_sessions(self, user_id: str, num_sessions: int = 8) -> Optional[List[Dict]]:
@@ -77,11 +121,14 @@ class SupabaseConnection:
         """
         self._print_info(f"Fetching {num_sessions} sessions for user: {user_id}")
         
+        # The ORDER BY is what makes LIMIT pick the newest sessions. It matches
+        # behavior_features_user_time_idx (user_id, generated_at DESC), so
+        # Postgres reads the index forward and never sorts.
         try:
             response = (
                 self.client
                 .table('behavior_features')
-                .select('*')
+                .select(','.join(['generated_at', *FEATURE_NAMES]))
                 .eq('user_id', user_id)
                 .order('generated_at', desc=True)
                 .limit(num_sessions)
@@ -101,6 +148,95 @@ class SupabaseConnection:
             self._print_error(f"Error fetching sessions: {str(e)}")
             return None
     
+    def fetch_fresh_profile(self, user_id: str) -> Optional[Dict]:
+        """
+        Fetch the user's stored profile if no session is newer than it
+        
+        Runs two single-row lookups (latest profile, latest session time)
+        instead of fetching and recomputing all sessions. Freshness compares
+        the profile's latest_session_at with the newest session's
+        generated_at; both are client timestamps, so they share a clock.
+        
+        Args:
+            user_id: The user's UUID
+        
+        Returns:
+            Stored profile record if still up to date, None otherwise
+        """
+        try:
+            profile_response = (
+                self.client
+                .table('user_profiles')
+                .select('*')
+                .eq('user_id', user_id)
+                .not_.is_('latest_session_at', 'null')
+                .order('latest_session_at', desc=True)
+                .limit(1)
+                .execute()
+            )
+            if not profile_response.data:
+                return None
+            
+            session_response = (
+                self.client
+                .table('behavior_features')
+                .select('generated_at')
+                .eq('user_id', user_id)
+                .order('generated_at', desc=True)
+                .limit(1)
+                .execute()
+            )
+            
+            profile = profile_response.data[0]
+            if session_response.data:
+                built_from = _parse_timestamp(profile['latest_session_at'])
+                newest_session = _parse_timestamp(session_response.data[0]['generated_at'])
+                if newest_session > built_from:
+                    return None
+            
+            self._print_success("Stored profile is up to date")
+            return profile
+        
+        except Exception as e:
+            self._print_error(f"Error checking stored profile: {str(e)}")
+            return None
+    
+    def rebuild_profile(self, user_id: str, num_sessions: int = 8) -> Optional[Dict]:
+        """
+        Rebuild and store the user's profile entirely in the database
+        
+        Calls the rebuild_profile RPC, which aggregates the newest sessions
+        and inserts the profile in a single statement.
+        
+        Args:
+            user_id: The user's UUID
+            num_sessions: Number of sessions to aggregate (default 8)
+        
+        Returns:
+            Stored profile record, or None if too few sessions or error
+        """
+        self._print_info(f"Rebuilding profile from {num_sessions} sessions for user: {user_id}")
+        
+        try:
+            response = self.client.rpc(
+                'rebuild_profile',
+                {'uid': user_id, 'n': num_sessions, 'min_sessions': MIN_SESSIONS_FOR_PROFILE}
+            ).execute()
+            
+            # The call succeeded; no row means too few sessions
+            if not response.data:
+                self._print_error(
+                    f"Need at least {MIN_SESSIONS_FOR_PROFILE} sessions for user {user_id}"
+                )
+                return None
+            
+            self._print_success("Profile saved successfully!")
+            return response.data[0]
+        
+        except Exception as e:
+            self._print_error(f"Error rebuilding profile: {str(e)}")
+            return None
+    
     def save_profile(self, profile: Dict) -> bool:
         """
         Save user profile to database
@@ -122,6 +258,44 @@ class SupabaseConnection:
             self._print_error(f"Error saving profile: {str(e)}")
             return False
     
+    def save_profiles(self, profiles: List[Dict], batch_size: int = SAVE_BATCH_SIZE) -> Optional[int]:
+        """
+        Save several user profiles to database using batched inserts
+        
+        Batches are inserted in order and stop at the first failure. Rows
+        before the returned offset are already committed, so a retry should
+        resume with profiles[offset:] to avoid inserting them twice.
+        
+        Args:
+            profiles: List of profile dictionaries to save
+            batch_size: Maximum number of rows per insert (default 500)
+        
+        Returns:
+            None if every batch was saved, otherwise the offset of the
+            first row of the failing batch
+        """
+        self._print_info(f"Saving {len(profiles)} profiles to database...")
+        
+        rows = iter(profiles)
+        for batch_index in itertools.count():
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            
+            try:
+                self.client.table('user_profiles').insert(batch).execute()
+            
+            except Exception as e:
+                offset = batch_index * batch_size
+                self._print_error(
+                    f"Error saving profiles (batch {batch_index}, "
+                    f"rows {offset}+): {str(e)}"
+                )
+                return offset
+        
+        self._print_success(f"Saved {len(profiles)} profiles successfully!")
+        return None
+    
     @staticmethod
     def _print_success(msg: str):
         """Print success message"""
@@ -138,6 +312,39 @@ class SupabaseConnection:
         print(f"📊 {msg}")
 
 
+# ============================================
+# PROFILE CACHE
+# ============================================
+
+_profile_cache: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+_profile_cache_lock = threading.Lock()
+
+
+def _get_cached_profile(user_id: str) -> Optional[Dict]:
+    """Return a copy of the cached profile for a user if it has not expired"""
+    with _profile_cache_lock:
+        entry = _profile_cache.get(user_id)
+        if entry is None:
+            return None
+        
+        expires_at, profile = entry
+        if expires_at <= time.monotonic():
+            del _profile_cache[user_id]
+            return None
+        
+        _profile_cache.move_to_end(user_id)
+        return dict(profile)
+
+
+def _cache_profile(user_id: str, profile: Dict):
+    """Store a copy of a built profile, evicting the least recently used if full"""
+    with _profile_cache_lock:
+        _profile_cache[user_id] = (time.monotonic() + PROFILE_CACHE_TTL, dict(profile))
+        _profile_cache.move_to_end(user_id)
+        while len(_profile_cache) > PROFILE_CACHE_MAXSIZE:
+            _profile_cache.popitem(last=False)
+
+
 # ============================================
 # PROFILE BUILDER
 # ============================================
@@ -161,85 +368,137 @@ class ProfileBuilder:
         """
         self._print_header("BUILDING USER PROFILE")
         
-        # Step 1: Fetch sessions
-        sessions = self.supabase.fetch_sessions(user_id, MIN_SESSIONS_REQUIRED)
-        if not sessions or len(sessions) < 2:
-            self._print_error(f"Need at least 2 sessions (found {len(sessions) if sessions else 0})")
-            return None
-        
-        # Step 2: Extract features
-        feature_matrix, _ = self._extract_features(sessions)
-        
-        # Step 3: Calculate statistics
-        means = self._calculate_means(feature_matrix)
-        stds = self._calculate_stds(feature_matrix)
-        
-        # Step 4: Create profile
-        profile = self._create_profile(user_id, means, stds, len(sessions))
-        
-        # Step 5: Save to database
-        if not self.supabase.save_profile(profile):
+        # Reuse a profile built within the last PROFILE_CACHE_TTL seconds
+        cached = _get_cached_profile(user_id)
+        if cached is not None:
+            print(f"♻️  Using cached profile for user: {user_id}")
+            return cached
+        
+        # Skip the rebuild if the stored profile is newer than every session
+        stored = self.supabase.fetch_fresh_profile(user_id)
+        if stored is not None:
+            _cache_profile(user_id, stored)
+            return stored
+        
+        # Steps 1-5: Aggregate sessions and save the profile in the database
+        profile = self.supabase.rebuild_profile(user_id, MIN_SESSIONS_REQUIRED)
+        if profile is None:
             return None
+        _cache_profile(user_id, profile)
         
         # Step 6: Print summary
         self._print_summary(profile)
         
         return profile
     
-    def _extract_features(self, sessions: List[Dict]) -> Tuple[np.ndarray, List[str]]:
+    def build_many(self, user_ids: List[str]) -> Dict[str, Dict]:
         """
-        Extract features from sessions into matrix
+        Build profiles for several users
+        
+        Sessions are fetched concurrently (the fetches are network-bound),
+        then every profile is saved with a single batched insert.
         
         Args:
-            sessions: List of session records
+            user_ids: List of user UUIDs
         
         Returns:
-            Tuple of (feature_matrix, feature_names)
+            Dictionary mapping user_id to profile for every user whose
+            profile was built and saved. If a save batch fails, only the
+            profiles committed before it are included.
         """
-        print("\n🔍 Extracting features...")
-        
-        feature_matrix = []
-        
-        for i, session in enumerate(sessions):
-            row = []
-            for feature_name in FEATURE_NAMES:
-                value = float(session.get(feature_name, 0))
-                row.append(value)
-            feature_matrix.append(row)
-            print(f"   Session {i+1}: {len(row)} features extracted")
+        self._print_header(f"BUILDING {len(user_ids)} USER PROFILES")
+        
+        # Step 1: Fetch sessions for all users concurrently
+        workers = max(1, min(MAX_CONCURRENT_FETCHES, len(user_ids)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            all_sessions = list(executor.map(
+                lambda uid: self.supabase.fetch_sessions(uid, MIN_SESSIONS_REQUIRED),
+                user_ids
+            ))
+        
+        # Steps 2-4: Compute a profile for every user with enough sessions
+        profiles = {}
+        for user_id, sessions in zip(user_ids, all_sessions):
+            if not sessions or len(sessions) < MIN_SESSIONS_FOR_PROFILE:
+                self._print_error(
+                    f"Skipping {user_id}: need at least {MIN_SESSIONS_FOR_PROFILE} sessions "
+                    f"(found {len(sessions) if sessions else 0})"
+                )
+                continue
+            profiles[user_id] = self._compute_profile(user_id, sessions)
+        
+        if not profiles:
+            return {}
+        
+        # Step 5: Save all profiles in batches, keeping only those committed
+        failed_at = self.supabase.save_profiles(list(profiles.values()))
+        if failed_at is not None:
+            profiles = dict(itertools.islice(profiles.items(), failed_at))
+        
+        for user_id, profile in profiles.items():
+            _cache_profile(user_id, profile)
+        
+        return profiles
+    
+    def _compute_profile(self, user_id: str, sessions: List[Dict]) -> Dict:
+        """Calculate statistics and create the profile"""
+        means, stds = self._calculate_stats(sessions)
         
-        feature_matrix = np.array(feature_matrix)
-        print(f"✅ Extracted {feature_matrix.shape[0]}×{feature_matrix.shape[1]} matrix")
+        profile = self._create_profile(user_id, means, stds, len(sessions))
+        # fetch_sessions returns the newest session first
+        profile['latest_session_at'] = sessions[0].get('generated_at')
         
-        return feature_matrix, FEATURE_NAMES
+        return profile
     
-    def _calculate_means(self, feature_matrix: np.ndarray) -> np.ndarray:
-        """Calculate mean for each feature"""
-        print("\n📈 Calculating means...")
+    def _calculate_stats(self, sessions: List[Dict]) -> Tuple[List[float], List[float]]:
+        """
+        Calculate mean and standard deviation for each feature
         
-        means = np.mean(feature_matrix, axis=0)
+        Features are read and folded into running statistics (Welford's
+        algorithm) in a single pass over the sessions, without building
+        an intermediate feature matrix.
         
-        for i, name in enumerate(FEATURE_NAMES):
-            print(f"   {name}: {means[i]:.6f}")
+        Args:
+            sessions: List of session records
         
-        return means
-    
-    def _calculate_stds(self, feature_matrix: np.ndarray) -> np.ndarray:
-        """Calculate standard deviation for each feature"""
-        print("\n📈 Calculating standard deviations...")
+        Returns:
+            Tuple of (means, stds) in FEATURE_NAMES order
+        """
+        log.debug("Calculating means and standard deviations...")
+        
+        n = 0
+        means = [0.0] * len(FEATURE_NAMES)
+        m2 = [0.0] * len(FEATURE_NAMES)
+        
+        for session in sessions:
+            # fetch_sessions selects exactly FEATURE_NAMES, so every key is normally
+            # present; fall back to a default of 0 only for incomplete records.
+            # NULL values also count as 0, matching coalesce() in build_profile_stats
+            try:
+                values = _FEATURE_GETTER(session)
+            except KeyError:
+                values = [session.get(name, 0.0) for name in FEATURE_NAMES]
+            
+            n += 1
+            for j, value in enumerate(values):
+                x = float(value) if value is not None else 0.0
+                delta = x - means[j]
+                means[j] += delta / n
+                m2[j] += delta * (x - means[j])
         
-        stds = np.std(feature_matrix, axis=0)
+        stds = [math.sqrt(v / n) for v in m2]
         
-        for i, name in enumerate(FEATURE_NAMES):
-            print(f"   {name}: {stds[i]:.6f}")
+        if log.isEnabledFor(logging.DEBUG):
+            for name, mean, std in zip(FEATURE_NAMES, means, stds):
+                log.debug("%s: %.6f ± %.6f", name, mean, std)
         
-        return stds
+        return means, stds
     
     def _create_profile(
         self, 
         user_id: str, 
-        means: np.ndarray, 
-        stds: np.ndarray, 
+        means: List[float], 
+        stds: List[float], 
         num_sessions: int
     ) -> Dict:
         """
@@ -247,52 +506,37 @@ class ProfileBuilder:
         
         Args:
             user_id: The user's UUID
-            means: Array of mean values
-            stds: Array of standard deviation values
+            means: Mean value per feature
+            stds: Standard deviation per feature
             num_sessions: Number of sessions used
         
         Returns:
             Profile dictionary ready to save
         """
-        print("\n✅ Creating profile...")
+        log.debug("Creating profile...")
         
         # Calculate data quality score (0-1)
         # Lower variance = higher quality
-        avg_std = np.mean(stds)
-        quality_score = max(0, 1.0 - (avg_std * 0.5))
-        quality_score = min(1.0, quality_score)  # Cap at 1.0
+        # Keep in sync with the copy in supabase/migrations/*_rebuild_profile.sql
+        avg_std = sum(stds) / len(stds)
+        quality_score = min(1.0, max(0.0, 1.0 - avg_std * 0.5))
         
         profile = {
             'user_id': user_id,
             'sessions_used': num_sessions,
             'status': 'active',
-            'data_quality_score': float(quality_score),
+            'data_quality_score': quality_score,
             'profile_version': 1,
-            
-            # Mean values
-            'typing_speed_mean': float(means[0]),
-            'backspace_ratio_mean': float(means[1]),
-            'avg_keystroke_interval_mean': float(means[2]),
-            'keystroke_variance_mean': float(means[3]),
-            'avg_mouse_speed_mean': float(means[4]),
-            'mouse_move_variance_mean': float(means[5]),
-            'scroll_frequency_mean': float(means[6]),
-            'idle_ratio_mean': float(means[7]),
-            
-            # Standard deviation values
-            'typing_speed_std': float(stds[0]),
-            'backspace_ratio_std': float(stds[1]),
-            'avg_keystroke_interval_std': float(stds[2]),
-            'keystroke_variance_std': float(stds[3]),
-            'avg_mouse_speed_std': float(stds[4]),
-            'mouse_move_variance_std': float(stds[5]),
-            'scroll_frequency_std': float(stds[6]),
-            'idle_ratio_std': float(stds[7]),
         }
         
-        print(f"   User ID: {profile['user_id']}")
-        print(f"   Sessions: {profile['sessions_used']}")
-        print(f"   Quality: {profile['data_quality_score']:.2%}")
+        # Mean and standard deviation values
+        profile.update(zip(MEAN_COLUMNS, means))
+        profile.update(zip(STD_COLUMNS, stds))
+        
+        log.debug(
+            "Profile for %s: %d sessions, quality %.2f%%",
+            profile['user_id'], profile['sessions_used'], profile['data_quality_score'] * 100
+        )
         
         return profile
     
@@ -336,6 +580,11 @@ class ProfileBuilder:
         print("\n" + "="*70)
         print(f"🎯 {text}")
         print("="*70)
+    
+    @staticmethod
+    def _print_error(msg: str):
+        """Print error message"""
+        print(f"❌ {msg}")
 
 
 # ============================================
@@ -352,7 +601,12 @@ def main():
     print("USER PROFILE BUILDER")
     print("=" * 70)
     
-    builder = ProfileBuilder()
+    try:
+        builder = ProfileBuilder()
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return 1
+    
     profile = builder.build(user_id)
     
     if profile:
@@ -0,0 +1,25 @@
+-- ============================================
+-- BEHAVIOR FEATURES: PER-USER RECENCY INDEX
+-- ============================================
+--
+-- profile_builder.py fetches the newest sessions for a user:
+--
+--   SELECT <feature columns> FROM behavior_features
+--   WHERE user_id = $1 ORDER BY generated_at DESC LIMIT 8
+--
+-- A (user_id, generated_at DESC) btree turns this into an index range scan
+-- with no sort node. The feature columns are INCLUDEd so the query can be
+-- answered by an index-only scan without touching the heap.
+
+create index if not exists behavior_features_user_time_idx
+    on public.behavior_features (user_id, generated_at desc)
+    include (
+        typing_speed,
+        backspace_ratio,
+        avg_keystroke_interval,
+        keystroke_variance,
+        avg_mouse_speed,
+        mouse_move_variance,
+        scroll_frequency,
+        idle_ratio
+    );
@@ -0,0 +1,12 @@
+-- ============================================
+-- USER PROFILES: NEWEST SESSION USED
+-- ============================================
+--
+-- Records the generated_at of the newest behavior_features session a
+-- profile was built from. profile_builder.py compares it with the user's
+-- current newest generated_at to decide whether a rebuild is needed.
+-- Both values come from the same (browser) clock, so clock skew between
+-- client and server cannot make a stale profile look fresh.
+
+alter table public.user_profiles
+    add column if not exists latest_session_at timestamptz;
@@ -0,0 +1,69 @@
+-- ============================================
+-- BUILD PROFILE STATS (RPC)
+-- ============================================
+--
+-- Computes the per-feature mean and std dev over a user's newest n sessions
+-- on the database server, so profile_builder.py receives one row of
+-- statistics instead of n rows of raw features. latest_session_at is the
+-- newest generated_at among the aggregated sessions.
+--
+-- Uses stddev_pop to match the population std computed by
+-- ProfileBuilder._calculate_stats. Missing or NULL feature values count as 0,
+-- as they do there.
+
+create or replace function public.build_profile_stats(uid uuid, n int default 8)
+returns table (
+    sessions_used int,
+    latest_session_at timestamptz,
+    typing_speed_mean float8,
+    typing_speed_std float8,
+    backspace_ratio_mean float8,
+    backspace_ratio_std float8,
+    avg_keystroke_interval_mean float8,
+    avg_keystroke_interval_std float8,
+    keystroke_variance_mean float8,
+    keystroke_variance_std float8,
+    avg_mouse_speed_mean float8,
+    avg_mouse_speed_std float8,
+    mouse_move_variance_mean float8,
+    mouse_move_variance_std float8,
+    scroll_frequency_mean float8,
+    scroll_frequency_std float8,
+    idle_ratio_mean float8,
+    idle_ratio_std float8
+)
+language sql
+stable
+as $$
+    select
+        count(*)::int,
+        max(t.generated_at)::timestamptz,
+        avg(t.typing_speed), stddev_pop(t.typing_speed),
+        avg(t.backspace_ratio), stddev_pop(t.backspace_ratio),
+        avg(t.avg_keystroke_interval), stddev_pop(t.avg_keystroke_interval),
+        avg(t.keystroke_variance), stddev_pop(t.keystroke_variance),
+        avg(t.avg_mouse_speed), stddev_pop(t.avg_mouse_speed),
+        avg(t.mouse_move_variance), stddev_pop(t.mouse_move_variance),
+        avg(t.scroll_frequency), stddev_pop(t.scroll_frequency),
+        avg(t.idle_ratio), stddev_pop(t.idle_ratio)
+    from (
+        select
+            f.generated_at,
+            coalesce(f.typing_speed, 0)::float8 as typing_speed,
+            coalesce(f.backspace_ratio, 0)::float8 as backspace_ratio,
+            coalesce(f.avg_keystroke_interval, 0)::float8 as avg_keystroke_interval,
+            coalesce(f.keystroke_variance, 0)::float8 as keystroke_variance,
+            coalesce(f.avg_mouse_speed, 0)::float8 as avg_mouse_speed,
+            coalesce(f.mouse_move_variance, 0)::float8 as mouse_move_variance,
+            coalesce(f.scroll_frequency, 0)::float8 as scroll_frequency,
+            coalesce(f.idle_ratio, 0)::float8 as idle_ratio
+        from public.behavior_features f
+        where f.user_id = uid
+        order by f.generated_at desc
+        limit n
+    ) t;
+$$;
+
+-- Only the service-role profile builder may call this through PostgREST
+revoke execute on function public.build_profile_stats(uuid, int) from public, anon, authenticated;
+grant execute on function public.build_profile_stats(uuid, int) to service_role;
@@ -0,0 +1,85 @@
+-- ============================================
+-- REBUILD PROFILE (RPC)
+-- ============================================
+--
+-- Reads, aggregates and stores a user's profile in a single statement, so
+-- profile_builder.py needs one round trip per build. Returns the inserted
+-- row, or no row if the user has fewer than min_sessions sessions.
+--
+-- data_quality_score mirrors ProfileBuilder._create_profile:
+--   clip(1 - mean(stds) * 0.5, 0, 1)
+
+create or replace function public.rebuild_profile(
+    uid uuid,
+    n int default 8,
+    min_sessions int default 2
+)
+returns setof public.user_profiles
+language sql
+volatile
+as $$
+    insert into public.user_profiles (
+        user_id,
+        sessions_used,
+        status,
+        data_quality_score,
+        profile_version,
+        latest_session_at,
+        typing_speed_mean,
+        backspace_ratio_mean,
+        avg_keystroke_interval_mean,
+        keystroke_variance_mean,
+        avg_mouse_speed_mean,
+        mouse_move_variance_mean,
+        scroll_frequency_mean,
+        idle_ratio_mean,
+        typing_speed_std,
+        backspace_ratio_std,
+        avg_keystroke_interval_std,
+        keystroke_variance_std,
+        avg_mouse_speed_std,
+        mouse_move_variance_std,
+        scroll_frequency_std,
+        idle_ratio_std
+    )
+    select
+        uid,
+        s.sessions_used,
+        'active',
+        greatest(0.0, least(1.0, 1.0 - (
+            s.typing_speed_std
+            + s.backspace_ratio_std
+            + s.avg_keystroke_interval_std
+            + s.keystroke_variance_std
+            + s.avg_mouse_speed_std
+            + s.mouse_move_variance_std
+            + s.scroll_frequency_std
+            + s.idle_ratio_std
+        ) / 8 * 0.5)),
+        1,
+        s.latest_session_at,
+        s.typing_speed_mean,
+        s.backspace_ratio_mean,
+        s.avg_keystroke_interval_mean,
+        s.keystroke_variance_mean,
+        s.avg_mouse_speed_mean,
+        s.mouse_move_variance_mean,
+        s.scroll_frequency_mean,
+        s.idle_ratio_mean,
+        s.typing_speed_std,
+        s.backspace_ratio_std,
+        s.avg_keystroke_interval_std,
+        s.keystroke_variance_std,
+        s.avg_mouse_speed_std,
+        s.mouse_move_variance_std,
+        s.scroll_frequency_std,
+        s.idle_ratio_std
+    from public.build_profile_stats(uid, n) s
+    where s.sessions_used >= min_sessions
+    returning *;
+$$;
+
+-- Only the service-role profile builder may write profiles; the browser's
+-- publishable key must not be able to call this through PostgREST
+revoke execute on function public.rebuild_profile(uuid, int, int) from public, anon, authenticated;
+grant execute on function public.rebuild_profile(uuid, int, int) to service_role;